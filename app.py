@@ -1,14 +1,193 @@
 # app.py
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify
 import pickle
 import numpy as np
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
 import os
 import json
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from functools import lru_cache
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
 
 app = Flask(__name__)
 
+# Precision used to hold the corpus embeddings in memory: 'fp32' (default)
+# scores the memory-mapped float32 .npy directly and is the fastest. 'fp16'
+# halves the resident corpus (a float16 .npy stays memory-mapped as is) but
+# is a memory-footprint option only: NumPy has no float16 matmul, so rows are
+# widened block by block and queries run several times slower than at fp32.
+# 'int8' likewise quarters the resident corpus at a small accuracy cost that
+# does not noticeably change the ranking, and is not faster than fp32 either
+EMBEDDING_PRECISION = os.environ.get('EMBEDDING_PRECISION', 'fp32').lower()
+
+# Rows scored per block when the corpus has to be widened before the dot
+# product; small enough that the widened temporary stays cache-sized
+SCORE_BLOCK_ROWS = 4096
+
+# Concurrent queries are coalesced into one forward pass of up to this many
+# queries, waiting at most this many seconds for the batch to fill. Batching
+# needs several requests in flight per process, e.g. gunicorn --threads
+ENCODE_BATCH_SIZE = 16
+ENCODE_BATCH_WINDOW = 0.005
+
+# Corpora with at least this many embeddings are searched through an HNSW
+# graph (when hnswlib is installed); smaller ones are scored exactly
+ANN_MIN_EMBEDDINGS = 5000
+
+# Exact fp32 searches over fewer embeddings than this use the fused Numba
+# kernel (when numba is installed) instead of a matrix-vector product and sort
+FUSED_TOPK_MAX_EMBEDDINGS = 100000
+
+# Per-message fields returned with each search result, stored as column arrays
+RESULT_FIELDS = ('content', 'username', 'timestamp', 'source_file', 'line_number', 'discord_link')
+
+class QueryBatcher:
+    """
+    Encode queries from concurrent requests in shared model batches.
+    
+    Requests put (query, future) pairs on a queue; a background thread
+    drains it into batches and resolves each future with its embedding.
+    """
+    
+    def __init__(self, model, batch_size=ENCODE_BATCH_SIZE, window=ENCODE_BATCH_WINDOW):
+        self.model = model
+        self.batch_size = batch_size
+        self.window = window
+        self.requests = queue.Queue()
+        self.worker = None
+        self.lock = threading.Lock()
+    
+    def encode(self, query):
+        """
+        Encode a single query, blocking until its batch has been run.
+        
+        Args:
+            query (str): Search query
+        
+        Returns:
+            np.ndarray: Raw query embedding from the model
+        """
+        # Started on first use so each forked worker gets its own thread
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self._run, daemon=True)
+                self.worker.start()
+        
+        future = Future()
+        self.requests.put((query, future))
+        return future.result()
+    
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            # A lone query is encoded right away; only when others are already
+            # queued is it worth waiting briefly for the batch to fill
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.batch_size and (len(batch) > 1 or not self.requests.empty()):
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            
+            try:
+                embeddings = self.model.encode([query for query, _ in batch], batch_size=len(batch))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+def load_ann_index(embeddings, index_path):
+    """
+    Load the HNSW index for the embeddings, building and saving it if needed.
+    
+    Args:
+        embeddings (np.ndarray): Normalized corpus embeddings
+        index_path (str): Path the index is persisted to
+    
+    Returns:
+        hnswlib.Index: Inner-product index over the embeddings
+    """
+    index = hnswlib.Index(space='ip', dim=embeddings.shape[1])
+    
+    if os.path.exists(index_path):
+        index.load_index(index_path, max_elements=len(embeddings))
+        if index.get_current_count() == len(embeddings):
+            return index
+        index = hnswlib.Index(space='ip', dim=embeddings.shape[1])
+    
+    print(f"Building HNSW index for {len(embeddings)} embeddings...")
+    index.init_index(max_elements=len(embeddings), ef_construction=200, M=16)
+    index.add_items(embeddings, np.arange(len(embeddings)))
+    index.save_index(index_path)
+    return index
+
+def format_discord_link(metadata):
+    """
+    Build the Discord URL for a message, if its IDs were exported.
+    
+    Args:
+        metadata (dict): Message metadata entry
+    
+    Returns:
+        str: Link to the message in Discord, or None
+    """
+    if 'discord_info' not in metadata:
+        return None
+    discord_info = metadata['discord_info']
+    return f"https://discord.com/channels/{discord_info['guild_id']}/{discord_info['channel_id']}/{discord_info['message_id']}"
+
+def write_atomically(path, write):
+    """
+    Write a file through a uniquely named temporary file beside it, then move
+    it into place, so processes migrating at the same time never read or
+    clobber a half-written file.
+    
+    Args:
+        path (str): Destination path
+        write (callable): Called with the open binary temporary file
+    """
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(path)), delete=False) as f:
+        try:
+            write(f)
+        except BaseException:
+            f.close()
+            os.remove(f.name)
+            raise
+    # Temporary files are created 0600; give the file the destination's mode,
+    # or the usual umask default for a new file
+    if os.path.exists(path):
+        mode = os.stat(path).st_mode & 0o7777
+    else:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    os.chmod(f.name, mode)
+    os.replace(f.name, path)
+
 # Load vector database
 def load_vector_database(file_path='vectors.pkl'):
     """
@@ -24,16 +203,188 @@ def load_vector_database(file_path='vectors.pkl'):
         print(f"Error: Vector database file '{file_path}' not found.")
         return None
     
+    # Normalized embeddings live next to the pickle so they can be memory-mapped
+    embeddings_path = os.path.splitext(file_path)[0] + '.npy'
+    
     try:
         with open(file_path, 'rb') as f:
             vector_database = pickle.load(f)
         
+        migrated = False
+        if 'embeddings' in vector_database:
+            # The corpus is static, so L2-normalize it once here and score
+            # queries with a single matrix-vector product later on
+            embeddings = np.ascontiguousarray(vector_database['embeddings'], dtype=np.float32)
+            if embeddings.ndim == 2:
+                embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True).clip(min=1e-12)
+                
+                # One-time migration: move the embeddings out of the pickle
+                print(f"Moving embeddings to '{embeddings_path}'")
+                write_atomically(embeddings_path, lambda f: np.save(f, embeddings))
+                del vector_database['embeddings']
+                migrated = True
+        
+        # One-time migration: the model is loaded from its own files below, so
+        # stop unpickling a copy of its weights on every start
+        if vector_database.pop('model', None) is not None:
+            migrated = True
+        
+        # One-time migration: keep just the content of each message rather
+        # than a second copy of the whole message in its metadata
+        for m in vector_database['message_metadata']:
+            original_message = m.pop('original_message', None)
+            if original_message is not None:
+                m['content'] = original_message.get('content')
+                migrated = True
+        
+        if migrated:
+            write_atomically(file_path, lambda f: pickle.dump(vector_database, f))
+        
+        if 'embeddings' not in vector_database:
+            # Pages are shared between processes and faulted in on demand
+            embeddings = np.load(embeddings_path, mmap_mode='r')
+        
+        if hnswlib is not None and embeddings.ndim == 2 and len(embeddings) >= ANN_MIN_EMBEDDINGS:
+            index_path = os.path.splitext(file_path)[0] + '_hnsw.bin'
+            # A pickle migrated after the index was saved invalidates it
+            if os.path.exists(index_path) and os.path.getmtime(index_path) < os.path.getmtime(embeddings_path):
+                os.remove(index_path)
+            vector_database['ann_index'] = load_ann_index(embeddings, index_path)
+        
+        if EMBEDDING_PRECISION == 'fp16' and embeddings.ndim == 2:
+            embeddings = embeddings.astype(np.float16, copy=False)
+        elif EMBEDDING_PRECISION == 'int8' and embeddings.ndim == 2:
+            # Symmetric per-row quantization: row ~= embedding_scale[row] * int8 row
+            embeddings = np.asarray(embeddings, dtype=np.float32)
+            scale = np.abs(embeddings).max(axis=1).clip(min=1e-12) / 127.0
+            embeddings = np.round(embeddings / scale[:, None]).astype(np.int8)
+            vector_database['embedding_scale'] = scale.astype(np.float32)
+        elif embeddings.dtype != np.float32:
+            # Embeddings saved as float16 are widened once, since casting the
+            # corpus on every query costs far more than the copy
+            embeddings = embeddings.astype(np.float32)
+        vector_database['embeddings'] = embeddings
+        
+        # Lay the result fields out as parallel arrays, so a search gathers its
+        # top results by fancy indexing instead of nested dict lookups per row
+        message_metadata = vector_database['message_metadata']
+        vector_database['content'] = np.array([m['content'] for m in message_metadata], dtype=object)
+        vector_database['username'] = np.array([m['username'] for m in message_metadata], dtype=object)
+        vector_database['timestamp'] = np.array([m['timestamp'] for m in message_metadata], dtype=object)
+        vector_database['source_file'] = np.array([m['source_file'] for m in message_metadata], dtype=object)
+        # Object dtype, since messages without a line number keep None
+        vector_database['line_number'] = np.array([m['line_number'] for m in message_metadata], dtype=object)
+        vector_database['discord_link'] = np.array([format_discord_link(m) for m in message_metadata], dtype=object)
+        
+        # Load the model from a local snapshot (safetensors) when MODEL_DIR is
+        # set, otherwise by name through the sentence-transformers cache
+        vector_database['model'] = SentenceTransformer(os.environ.get('MODEL_DIR') or vector_database['model_name'])
+        vector_database['query_batcher'] = QueryBatcher(vector_database['model'])
+        
         print(f"Loaded vector database with {len(vector_database['embeddings'])} embeddings")
         return vector_database
     except Exception as e:
         print(f"Error loading vector database: {str(e)}")
         return None
 
+topk_cosine = None
+# Numba's default workqueue threading layer aborts the process when two
+# threads (e.g. gunicorn --threads) run a parallel kernel at once
+topk_cosine_lock = threading.Lock()
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def topk_cosine(embeddings, query_embedding, k):
+        """
+        Score every embedding against the query and select the top k in one kernel.
+        
+        Args:
+            embeddings (np.ndarray): Normalized float32 corpus embeddings
+            query_embedding (np.ndarray): Normalized float32 query embedding
+            k (int): Number of top results to select, at most len(embeddings)
+        
+        Returns:
+            tuple: Indices and scores of the top k embeddings, best first
+        """
+        n, d = embeddings.shape
+        scores = np.empty(n, np.float32)
+        for i in prange(n):
+            score = np.float32(0.0)
+            for j in range(d):
+                score += embeddings[i, j] * query_embedding[j]
+            scores[i] = score
+        
+        # Keep the best k seen so far in descending order by insertion; cosine
+        # scores are never below -1, and fastmath assumes no infinities
+        top_indices = np.zeros(k, np.int64)
+        top_scores = np.full(k, -2.0, np.float32)
+        for i in range(n):
+            score = scores[i]
+            if score <= top_scores[k - 1]:
+                continue
+            pos = k - 1
+            while pos > 0 and top_scores[pos - 1] < score:
+                top_scores[pos] = top_scores[pos - 1]
+                top_indices[pos] = top_indices[pos - 1]
+                pos -= 1
+            top_scores[pos] = score
+            top_indices[pos] = i
+        return top_indices, top_scores
+
+def score_embeddings(vector_database, query_embedding):
+    """
+    Compute cosine similarities between a unit-length query and the corpus.
+    
+    Args:
+        vector_database (dict): Loaded vector database
+        query_embedding (np.ndarray): Normalized float32 query embedding
+    
+    Returns:
+        np.ndarray: float32 similarity for every embedding
+    """
+    embeddings = vector_database['embeddings']
+    
+    if embeddings.dtype == np.float32:
+        # Rows are unit length, so the dot product is the cosine similarity
+        return embeddings @ query_embedding
+    
+    if embeddings.dtype == np.int8:
+        # Quantize the query the same way. NumPy's integer matmul has no BLAS
+        # path, so the products run in float32, where sums of int8 products
+        # up to 768 dimensions are still exact integers
+        query_scale = max(float(np.abs(query_embedding).max()), 1e-12) / 127.0
+        query_vector = np.round(query_embedding / query_scale).astype(np.float32)
+    else:
+        query_vector = query_embedding
+    
+    # Widen the narrow rows a cache-sized block at a time, so no full-size
+    # wide copy of the corpus is ever made
+    similarities = np.empty(len(embeddings), dtype=np.float32)
+    for start in range(0, len(embeddings), SCORE_BLOCK_ROWS):
+        block = embeddings[start:start + SCORE_BLOCK_ROWS]
+        similarities[start:start + len(block)] = block.astype(np.float32) @ query_vector
+    
+    if embeddings.dtype == np.int8:
+        similarities *= vector_database['embedding_scale'] * np.float32(query_scale)
+    return similarities
+
+@lru_cache(maxsize=4096)
+def encode_query(query_batcher, query):
+    """
+    Create a unit-length embedding for a query, caching repeat queries.
+    
+    Args:
+        query_batcher (QueryBatcher): Batcher wrapping the vectorization model
+        query (str): Search query
+    
+    Returns:
+        np.ndarray: Read-only normalized float32 query embedding
+    """
+    query_embedding = np.array(query_batcher.encode(query), dtype=np.float32)
+    query_embedding /= np.sqrt(np.vdot(query_embedding, query_embedding)) + 1e-12
+    # The array is shared by every cache hit, so guard it against mutation
+    query_embedding.setflags(write=False)
+    return query_embedding
+
 # Search vectors function
 def search_vectors(query, vector_database, top_k=10):
     """
@@ -45,42 +396,81 @@ def search_vectors(query, vector_database, top_k=10):
         top_k (int): Number of top results to return
     
     Returns:
-        list: Top k similar messages with scores
+        tuple: Indices and scores of the top k similar messages, best first
     """
+    no_results = (np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32))
+    
     try:
-        # Load the model used for vectorization
-        model = vector_database['model']
-        
-        # Create embedding for the query
-        query_embedding = model.encode([query])
+        # Create a unit-length embedding for the query, batched with any
+        # concurrent searches
+        query_embedding = encode_query(vector_database['query_batcher'], query.strip())
         
-        # Get all embeddings
+        # Get all (pre-normalized) embeddings
         embeddings = vector_database['embeddings']
         
         if len(embeddings) == 0:
             print("No embeddings found in database")
-            return []
-        
-        # Calculate cosine similarities
-        similarities = cosine_similarity(query_embedding, embeddings)[0]
-        
-        # Get top k indices
-        top_indices = np.argsort(similarities)[::-1][:top_k]
-        
-        # Get top k results with scores
-        results = []
-        for idx in top_indices:
-            if similarities[idx] > 0:  # Only include results with some similarity
-                results.append({
-                    'score': float(similarities[idx]),  # Convert to Python float
-                    'metadata': vector_database['message_metadata'][idx],
-                    'content': vector_database['message_metadata'][idx]['original_message']['content']
-                })
+            return no_results
+        
+        k = min(top_k, len(embeddings))
+        if k <= 0:
+            return no_results
+        
+        if 'ann_index' in vector_database:
+            # Approximate search only visits a small neighbourhood of the graph
+            ann_index = vector_database['ann_index']
+            ann_index.set_ef(max(64, k * 4))
+            labels, distances = ann_index.knn_query(query_embedding, k=k)
+            top_indices = labels[0].astype(np.intp)
+            top_scores = 1.0 - distances[0]  # 'ip' distances are 1 - dot product
+        elif topk_cosine is not None and embeddings.dtype == np.float32 and len(embeddings) < FUSED_TOPK_MAX_EMBEDDINGS:
+            # Reads the corpus once and selects the top k without a separate pass
+            with topk_cosine_lock:
+                top_indices, top_scores = topk_cosine(np.asarray(embeddings), query_embedding, k)
+        else:
+            similarities = score_embeddings(vector_database, query_embedding)
+            
+            # Partially select the top k indices, then sort just those k
+            top_indices = np.argpartition(-similarities, k - 1)[:k]
+            top_indices = top_indices[np.argsort(-similarities[top_indices])]
+            top_scores = similarities[top_indices]
         
-        return results
+        # Only include results with some similarity
+        keep = top_scores > 0
+        top_indices, top_scores = top_indices[keep], top_scores[keep]
+        
+        return top_indices, top_scores
     except Exception as e:
         print(f"Error in search_vectors: {str(e)}")
-        return []
+        return no_results
+
+@lru_cache(maxsize=256)
+def load_line_offsets(source_file, mtime):
+    """
+    Index the byte offset at which every line of a source file starts.
+    
+    Args:
+        source_file (str): Path to the source file
+        mtime (float): Modification time of the file, so edits invalidate the cache
+    
+    Returns:
+        np.ndarray: Start offset of each line, followed by the file size
+    """
+    size = os.path.getsize(source_file)
+    if size == 0:
+        return np.zeros(1, dtype=np.int64)
+    
+    data = np.memmap(source_file, dtype=np.uint8, mode='r')
+    # Match the universal newlines chunk.py numbered lines with: a line ends
+    # at '\n', '\r\n', or a lone '\r'
+    line_ends = data == ord('\n')
+    lone_cr = data == ord('\r')
+    lone_cr[:-1] &= data[1:] != ord('\n')
+    offsets = np.flatnonzero(line_ends | lone_cr) + 1
+    # A final line without a trailing newline still ends at the end of the file
+    if len(offsets) == 0 or offsets[-1] != size:
+        offsets = np.append(offsets, size)
+    return np.concatenate(([0], offsets)).astype(np.int64)
 
 # Load database once at startup
 print("Loading vector database...")
@@ -88,6 +478,59 @@ vector_database = load_vector_database('vectors.pkl')
 if vector_database is None:
     print("Warning: Vector database not loaded. Search functionality will be limited.")
 
+def format_results(top_indices, top_scores):
+    """
+    Build the JSON payload for each search result from the column arrays.
+    
+    Args:
+        top_indices (np.ndarray): Indices of the results, best first
+        top_scores (np.ndarray): Scores of the results
+    
+    Yields:
+        dict: Formatted search result
+    """
+    # Gather each field for all results at once; tolist() yields Python floats
+    columns = [vector_database[field][top_indices].tolist() for field in RESULT_FIELDS]
+    for score, content, username, timestamp, source_file, line_number, discord_link in zip(top_scores.tolist(), *columns):
+        formatted_result = {
+            'score': score,
+            'content': content,
+            'username': username,
+            'timestamp': timestamp,
+            'source_file': source_file,
+            'line_number': line_number
+        }
+        # Add Discord link information if available
+        if discord_link is not None:
+            formatted_result['discord_link'] = discord_link
+        yield formatted_result
+
+def dumps_json(obj):
+    """
+    Serialize an object to compact UTF-8 JSON, using orjson when installed.
+    
+    Args:
+        obj: JSON-serializable object
+    
+    Returns:
+        bytes: Encoded JSON
+    """
+    if orjson is None:
+        return json.dumps(obj).encode('utf-8')
+    return orjson.dumps(obj)
+
+def json_response(payload):
+    """
+    Serialize a payload into a JSON response.
+    
+    Args:
+        payload (dict): JSON-serializable response body
+    
+    Returns:
+        Response: application/json response
+    """
+    return Response(dumps_json(payload), mimetype='application/json')
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -110,27 +553,15 @@ def search():
             return jsonify({'error': 'No query provided'}), 400
         
         print(f"Searching for query: {query}")
-        results = search_vectors(query, vector_database, top_k)
-        
-        # Format results for JSON response
-        formatted_results = []
-        for result in results:
-            formatted_result = {
-                'score': result['score'],
-                'content': result['content'],
-                'username': result['metadata']['username'],
-                'timestamp': result['metadata']['timestamp'],
-                'source_file': result['metadata']['source_file'],
-                'line_number': result['metadata']['line_number']
-            }
-            # Add Discord link information if available
-            if 'discord_info' in result['metadata']:
-                discord_info = result['metadata']['discord_info']
-                formatted_result['discord_link'] = f"https://discord.com/channels/{discord_info['guild_id']}/{discord_info['channel_id']}/{discord_info['message_id']}"
-            formatted_results.append(formatted_result)
-        
-        print(f"Found {len(formatted_results)} results")
-        return jsonify({'results': formatted_results})
+        top_indices, top_scores = search_vectors(query, vector_database, top_k)
+        print(f"Found {len(top_indices)} results")
+        
+        if data.get('stream'):
+            # Send each result as soon as it is formatted, one JSON object per line
+            lines = (dumps_json(result) + b'\n' for result in format_results(top_indices, top_scores))
+            return Response(lines, mimetype='application/x-ndjson')
+        
+        return json_response({'results': list(format_results(top_indices, top_scores))})
         
     except Exception as e:
         print(f"Error in search endpoint: {str(e)}")
@@ -157,12 +588,21 @@ def get_context():
             return jsonify({'error': f'Source file not found: {full_path}'}), 404
         
         try:
-            with open(full_path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
+            offsets = load_line_offsets(full_path, os.path.getmtime(full_path))
             
             # Calculate start and end line numbers
             start_line = max(0, line_number - context_lines - 1)
-            end_line = min(len(lines), line_number + context_lines)
+            end_line = min(len(offsets) - 1, line_number + context_lines)
+            
+            # Read only the bytes spanning the requested lines
+            lines = []
+            if end_line > start_line:
+                with open(full_path, 'rb') as f:
+                    f.seek(int(offsets[start_line]))
+                    data = f.read(int(offsets[end_line] - offsets[start_line]))
+                # Cut at the indexed offsets so lines break exactly where they were numbered
+                bounds = (offsets[start_line:end_line + 1] - offsets[start_line]).tolist()
+                lines = [data[begin:end].decode('utf-8') for begin, end in zip(bounds, bounds[1:])]
             
             # Get context lines
             context_lines_list = []
@@ -171,7 +611,7 @@ def get_context():
                 marker = ">>> " if line_num == line_number else "   "
                 context_lines_list.append({
                     'line_number': line_num,
-                    'content': lines[i].rstrip(),
+                    'content': lines[i - start_line].rstrip(),
                     'is_target': line_num == line_number
                 })
             
@@ -191,4 +631,5 @@ def get_context():
 if __name__ == '__main__':
     # Change to listen on all interfaces to make it accessible from other machines
     print("Starting Flask app on all interfaces...")
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # The debug server adds per-request overhead, so only enable it in development
+    app.run(debug=bool(os.environ.get('DEV')), host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -1,23 +1,62 @@
 # chunk.py
 import json
 import os
-import re
 import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Lines look like [YYYY-MM-DD HH:MM:SS UTC] username: message content, so the
+# timestamp and the start of the username sit at fixed offsets
+_TS_SUFFIX = ' UTC] '
+_USERNAME_START = 26
+
+def dumps_json(obj):
+    """
+    Serialize an object to compact UTF-8 JSON, using orjson when installed.
+    
+    Args:
+        obj: Object to serialize; datetimes are written with str()
+    
+    Returns:
+        bytes: Encoded JSON
+    """
+    if orjson is not None:
+        # Pass datetimes through to str() so the output matches the json module
+        return orjson.dumps(obj, default=str, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(obj, ensure_ascii=False, default=str).encode('utf-8')
+
 def parse_timestamp(timestamp_str):
     """
     Parse timestamp string into datetime object.
     
     Args:
-        timestamp_str (str): Timestamp in format [YYYY-MM-DD HH:MM:SS UTC]
+        timestamp_str (str): Timestamp in format YYYY-MM-DD HH:MM:SS
     
     Returns:
         datetime: Parsed datetime object
     """
-    # Remove brackets and parse
-    timestamp_str = timestamp_str.strip('[]')
-    return datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S UTC')
+    # The format is fixed, so slice the fields instead of going through strptime
+    return datetime(int(timestamp_str[0:4]), int(timestamp_str[5:7]), int(timestamp_str[8:10]),
+                    int(timestamp_str[11:13]), int(timestamp_str[14:16]), int(timestamp_str[17:19]))
+
+def is_timestamp(timestamp_str):
+    """
+    Check that a string has the YYYY-MM-DD HH:MM:SS shape, digits included.
+    
+    Args:
+        timestamp_str (str): 19-character candidate timestamp
+    
+    Returns:
+        bool: True if the string is shaped like a timestamp
+    """
+    return (timestamp_str[4] + timestamp_str[7] + timestamp_str[10] + timestamp_str[13] + timestamp_str[16] == '-- ::'
+            and (timestamp_str[0:4] + timestamp_str[5:7] + timestamp_str[8:10] +
+                 timestamp_str[11:13] + timestamp_str[14:16] + timestamp_str[17:19]).isdecimal())
 
 def chunk_lines_to_json(input_file_path, output_file_path=None):
     """
@@ -31,61 +70,22 @@ def chunk_lines_to_json(input_file_path, output_file_path=None):
     # Get the filename without path
     filename = os.path.basename(input_file_path)
     
-    # Load metadata if it exists
-    metadata_path = input_file_path.replace('.txt', '_metadata.json')
+    # Load metadata if it exists, falling back to the older single-object file
+    metadata_path = input_file_path.replace('.txt', '_metadata.jsonl')
     metadata_map = {}
-    if os.path.exists(metadata_path):
-        try:
+    try:
+        if os.path.exists(metadata_path):
             with open(metadata_path, 'r', encoding='utf-8') as mf:
-                metadata_map = json.load(mf)
-        except Exception as e:
-            print(f"Warning: Could not load metadata from {metadata_path}: {e}")
-    
-    # Read all lines from the input file
-    with open(input_file_path, 'r', encoding='utf-8') as file:
-        lines = file.readlines()
-    
-    # Parse messages with timestamps
-    messages = []
-    for line_num, line in enumerate(lines, 1):
-        line = line.strip()
-        if not line:
-            continue
-            
-        # Match timestamp pattern [YYYY-MM-DD HH:MM:SS UTC] username: message content
-        timestamp_pattern = r'\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} UTC)\] (.*?): (.*)'
-        match = re.match(timestamp_pattern, line)
-        
-        if match:
-            timestamp_str, username, content = match.groups()
-            try:
-                timestamp = parse_timestamp(timestamp_str)
-                message_obj = {
-                    "line_number": line_num,
-                    "timestamp": timestamp,
-                    "username": username,
-                    "content": content,
-                    "source_file": filename
-                }
-                # Add Discord IDs if available in metadata
-                if str(line_num) in metadata_map:
-                    message_obj["discord_info"] = metadata_map[str(line_num)]
-                messages.append(message_obj)
-            except ValueError as e:
-                print(f"Warning: Could not parse timestamp in line {line_num}: {e}")
-        else:
-            # If line doesn't match timestamp pattern, treat as a standalone message
-            message_obj = {
-                "line_number": line_num,
-                "timestamp": None,
-                "username": None,
-                "content": line,
-                "source_file": filename
-            }
-            # Add Discord IDs if available in metadata
-            if str(line_num) in metadata_map:
-                message_obj["discord_info"] = metadata_map[str(line_num)]
-            messages.append(message_obj)
+                for entry_line in mf:
+                    if entry_line.strip():
+                        entry = json.loads(entry_line)
+                        metadata_map[entry.pop('line')] = entry
+        elif os.path.exists(metadata_path[:-1]):
+            metadata_path = metadata_path[:-1]
+            with open(metadata_path, 'r', encoding='utf-8') as mf:
+                metadata_map = {int(line): info for line, info in json.load(mf).items()}
+    except Exception as e:
+        print(f"Warning: Could not load metadata from {metadata_path}: {e}")
     
     # Determine output file path if not provided
     if output_file_path is None:
@@ -100,12 +100,68 @@ def chunk_lines_to_json(input_file_path, output_file_path=None):
     # Full path for the output file
     full_output_path = os.path.join(output_dir, output_file_path)
     
-    # Write to JSON file
-    with open(full_output_path, 'w', encoding='utf-8') as json_file:
-        json.dump(messages, json_file, indent=2, ensure_ascii=False, default=str)
-    
-    print(f"Successfully processed {len(messages)} messages from '{filename}'")
-    print(f"Output saved to '{full_output_path}'")
+    # Parse messages with timestamps, streaming each one into a JSON array
+    # as it is read so neither the lines nor the messages are held in memory
+    message_count = 0
+    # Bursts of messages share a timestamp, so parse each distinct one only once
+    timestamps = {}
+    with open(input_file_path, 'r', encoding='utf-8') as file, open(full_output_path, 'wb') as json_file:
+        json_file.write(b'[')
+        for line_num, line in enumerate(file, 1):
+            line = line.strip()
+            if not line:
+                continue
+            
+            # Split at the fixed offsets rather than running a regex per line
+            separator = -1
+            if line[0] == '[' and line[20:_USERNAME_START] == _TS_SUFFIX:
+                timestamp_str = line[1:20]
+                # Cached timestamps were already checked when first parsed
+                if timestamp_str in timestamps or is_timestamp(timestamp_str):
+                    separator = line.find(': ', _USERNAME_START)
+            
+            if separator >= 0:
+                username = line[_USERNAME_START:separator]
+                content = line[separator + 2:]
+                timestamp = timestamps.get(timestamp_str)
+                if timestamp is None:
+                    try:
+                        timestamp = parse_timestamp(timestamp_str)
+                    except ValueError as e:
+                        print(f"Warning: Could not parse timestamp in line {line_num}: {e}")
+                        continue
+                    timestamps[timestamp_str] = timestamp
+                message_obj = {
+                    "line_number": line_num,
+                    "timestamp": timestamp,
+                    "username": username,
+                    "content": content,
+                    "source_file": filename
+                }
+            else:
+                # If line doesn't match timestamp pattern, treat as a standalone message
+                message_obj = {
+                    "line_number": line_num,
+                    "timestamp": None,
+                    "username": None,
+                    "content": line,
+                    "source_file": filename
+                }
+            
+            # Add Discord IDs if available in metadata
+            discord_info = metadata_map.get(line_num)
+            if discord_info is not None:
+                message_obj["discord_info"] = discord_info
+            
+            if message_count:
+                json_file.write(b',')
+            json_file.write(dumps_json(message_obj))
+            message_count += 1
+        json_file.write(b']')
+    
+    # Flush so output from parallel workers arrives one file at a time
+    print(f"Successfully processed {message_count} messages from '{filename}'\n"
+          f"Output saved to '{full_output_path}'", flush=True)
 
 def process_directory(directory_path):
     """
@@ -120,7 +176,8 @@ def process_directory(directory_path):
         return
     
     # Get all .txt files in the directory
-    txt_files = [f for f in os.listdir(directory_path) if f.endswith('.txt') and os.path.isfile(os.path.join(directory_path, f))]
+    with os.scandir(directory_path) as entries:
+        txt_files = [entry.name for entry in entries if entry.name.endswith('.txt') and entry.is_file()]
     
     if not txt_files:
         print(f"No .txt files found in '{directory_path}'")
@@ -130,13 +187,17 @@ def process_directory(directory_path):
     for txt_file in txt_files:
         print(f"  - {txt_file}")
     
-    # Process each text file
-    for txt_file in txt_files:
-        input_file_path = os.path.join(directory_path, txt_file)
-        try:
-            chunk_lines_to_json(input_file_path)
-        except Exception as e:
-            print(f"Error processing '{txt_file}': {e}")
+    # Files are independent and parsing is CPU-bound, so process them in parallel
+    with ProcessPoolExecutor() as executor:
+        futures = {
+            executor.submit(chunk_lines_to_json, os.path.join(directory_path, txt_file)): txt_file
+            for txt_file in txt_files
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error processing '{futures[future]}': {e}")
 
 def main():
     # Default directory path
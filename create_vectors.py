@@ -6,6 +6,15 @@ from sentence_transformers import SentenceTransformer
 import numpy as np
 import pickle
 
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+# Set to 'fp16' to store the embeddings at half precision, halving vectors.npy.
+# The search scripts widen such files to float32 in memory when they load them
+EMBEDDING_STORAGE = os.environ.get('EMBEDDING_STORAGE', 'fp32').lower()
+
 def load_chunked_files(directory_path):
     """
     Load all chunked JSON files from the directory.
@@ -19,7 +28,8 @@ def load_chunked_files(directory_path):
     all_messages = []
     
     # Get all .json files in the directory
-    json_files = [f for f in os.listdir(directory_path) if f.endswith('_chunks.json') and os.path.isfile(os.path.join(directory_path, f))]
+    with os.scandir(directory_path) as entries:
+        json_files = [entry.name for entry in entries if entry.name.endswith('_chunks.json') and entry.is_file()]
     
     if not json_files:
         print(f"No chunked JSON files found in '{directory_path}'")
@@ -61,48 +71,78 @@ def create_vectors(messages, model_name='all-mpnet-base-v2', output_path='vector
     # Load the sentence transformer model
     model = SentenceTransformer(model_name)
     
-    # Extract message content for vectorization
-    message_contents = []
-    message_metadata = []
-    
-    for msg in messages:
-        content = msg.get('content', '')
-        if content:
-            message_contents.append(content)
-            metadata_entry = {
-                'line_number': msg.get('line_number'),
-                'timestamp': msg.get('timestamp'),
-                'username': msg.get('username'),
-                'source_file': msg.get('source_file'),
-                'original_message': msg
-            }
-            # Include discord_info if available
-            if 'discord_info' in msg:
-                metadata_entry['discord_info'] = msg['discord_info']
-            message_metadata.append(metadata_entry)
+    # Extract message content for vectorization. The metadata carries the
+    # content itself rather than a reference to the whole message
+    messages = [msg for msg in messages if msg.get('content')]
+    message_contents = [msg['content'] for msg in messages]
+    message_metadata = [
+        {
+            'line_number': msg.get('line_number'),
+            'timestamp': msg.get('timestamp'),
+            'username': msg.get('username'),
+            'source_file': msg.get('source_file'),
+            'content': msg['content']
+        }
+        for msg in messages
+    ]
+    
+    # Include discord_info if available
+    for metadata_entry, msg in zip(message_metadata, messages):
+        if 'discord_info' in msg:
+            metadata_entry['discord_info'] = msg['discord_info']
     
     print(f"Vectorizing {len(message_contents)} messages...")
     
     # Create embeddings
     if message_contents:
-        embeddings = model.encode(message_contents)
+        # Large batches keep the model's matmuls busy, and unit-length vectors
+        # let search score cosine similarity with a single dot product
+        embeddings = model.encode(
+            message_contents,
+            batch_size=256,
+            show_progress_bar=True,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
         print(f"Created embeddings of shape: {embeddings.shape}")
+        if EMBEDDING_STORAGE == 'fp16':
+            # Rounding unit vectors to float16 barely moves cosine scores or rankings
+            embeddings = embeddings.astype(np.float16)
     else:
         print("No content to vectorize")
         embeddings = np.array([])
     
-    # Save vector database
+    # Save vector database. The model is re-created from its name on load
+    # rather than pickled, and the embeddings go to a .npy file next to the
+    # pickle so the search scripts can memory-map them
     vector_database = {
         'model_name': model_name,
-        'embeddings': embeddings,
-        'message_metadata': message_metadata,
-        'model': model
+        'message_metadata': message_metadata
     }
+    if embeddings.ndim == 2:
+        embeddings_path = os.path.splitext(output_path)[0] + '.npy'
+        np.save(embeddings_path, embeddings)
+        print(f"Embeddings saved to '{embeddings_path}'")
+    else:
+        vector_database['embeddings'] = embeddings
     
     with open(output_path, 'wb') as f:
         pickle.dump(vector_database, f)
     
     print(f"Vectors saved to '{output_path}'")
+    
+    # Save an exact inner-product index over the normalized embeddings, which
+    # the search scripts use for SIMD scoring and heap-based top-k selection
+    index_path = os.path.splitext(output_path)[0] + '.faiss'
+    if faiss is not None and embeddings.ndim == 2:
+        index = faiss.IndexFlatIP(embeddings.shape[1])
+        index.add(embeddings.astype(np.float32))
+        faiss.write_index(index, index_path)
+        print(f"FAISS index saved to '{index_path}'")
+    elif os.path.exists(index_path):
+        # An index left over from an earlier run no longer matches these vectors
+        os.remove(index_path)
+        print(f"Removed stale FAISS index '{index_path}'")
     return embeddings, message_metadata
 
 def main():
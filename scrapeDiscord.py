@@ -2,11 +2,18 @@ import discord
 import asyncio
 import os
 import json
+from collections import defaultdict
 from datetime import timezone
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 TOKEN = "BOT_KEY"
 EXPORT_DIR = "discord_exports"
 STATE_FILE = "export_state.json"
+CHANNEL_CONCURRENCY = 6
 
 intents = discord.Intents.default()
 intents.message_content = True
@@ -20,16 +27,163 @@ def sanitize_filename(name: str) -> str:
     return "".join(c for c in name if c.isalnum() or c in (" ", "-", "_")).rstrip()
 
 
+def dumps_json(obj, indent=False):
+    # orjson when installed; both paths return UTF-8 bytes
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    if indent:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
 def load_state():
     if os.path.exists(STATE_FILE):
-        with open(STATE_FILE, "r") as f:
-            return json.load(f)
+        with open(STATE_FILE, "rb") as f:
+            return orjson.loads(f.read()) if orjson is not None else json.load(f)
     return {}
 
 
 def save_state(state):
-    with open(STATE_FILE, "w") as f:
-        json.dump(state, f, indent=2)
+    # The state file is small and meant to be read by hand, so keep it indented
+    with open(STATE_FILE, "wb") as f:
+        f.write(dumps_json(state, indent=True))
+
+
+def migrate_metadata(legacy_filename, metadata_filename):
+    # Older exports kept the line -> message map in one JSON object that was
+    # rewritten every run; convert it once to the append-only JSON Lines file
+    if not os.path.exists(legacy_filename) or os.path.exists(metadata_filename):
+        return
+    try:
+        with open(legacy_filename, "r", encoding="utf-8") as mf:
+            metadata_map = json.load(mf)
+        # Write to a temporary file first, so an interrupted migration never
+        # leaves a partial .jsonl behind that would stop it being retried
+        with open(metadata_filename + ".tmp", "wb") as mf:
+            for line, info in sorted(metadata_map.items(), key=lambda item: int(item[0])):
+                mf.write(dumps_json({"line": int(line), **info}) + b"\n")
+        os.replace(metadata_filename + ".tmp", metadata_filename)
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        print(f"Warning: could not migrate {legacy_filename}: {e}")
+        return
+    os.remove(legacy_filename)
+
+
+def count_lines(filename):
+    if not os.path.exists(filename):
+        return 0
+    count = 0
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            count += block.count(b"\n")
+    return count
+
+
+async def fetch_channel(channel, state, guild_dir, sem, state_lock, file_locks):
+    guild = channel.guild
+    tz = timezone.utc
+
+    filename = os.path.join(
+        guild_dir,
+        f"{sanitize_filename(channel.name)}.txt"
+    )
+    
+    metadata_filename = os.path.join(
+        guild_dir,
+        f"{sanitize_filename(channel.name)}_metadata.jsonl"
+    )
+
+    # Channels are rate-limited separately, so several are fetched at once,
+    # but channels whose names sanitize to the same file take turns with it
+    async with file_locks[filename], sem:
+        perms = channel.permissions_for(guild.me)
+        if not perms.read_message_history:
+            print(f"Skipping {channel.name} (no permission)")
+            return
+
+        channel_key = f"{guild.id}-{channel.id}"
+        channel_state = state.get(channel_key)
+        if isinstance(channel_state, dict):
+            last_id = channel_state.get("last_id")
+            line_count = channel_state.get("line_count")
+            export_size = channel_state.get("size")
+        else:
+            # Older state files stored just the last message id per channel
+            last_id = channel_state
+            line_count = export_size = None
+
+        migrate_metadata(metadata_filename[:-1], metadata_filename)
+
+        print(f"Updating #{channel.name}")
+
+        new_last_id = last_id
+        message_count = 0
+
+        # Line numbers continue from the count kept in the state file. If the
+        # export's size no longer matches it (an interrupted run, or another
+        # channel sharing the file), the lines are counted again
+        recounted = line_count is None or export_size != (
+            os.path.getsize(filename) if os.path.exists(filename) else 0
+        )
+        if recounted:
+            line_count = count_lines(filename)
+
+        # Both files are append-only, so write them through large buffers
+        with open(filename, "a", encoding="utf-8", buffering=1 << 20) as f, \
+                open(metadata_filename, "ab", buffering=1 << 20) as mf:
+
+            history_kwargs = {
+                "limit": None,
+                "oldest_first": True
+            }
+
+            if last_id:
+                history_kwargs["after"] = discord.Object(id=int(last_id))
+
+            async for message in channel.history(**history_kwargs):
+                dt = message.created_at.astimezone(tz)
+                timestamp = f"{dt.year:04d}-{dt.month:02d}-{dt.day:02d} {dt.hour:02d}:{dt.minute:02d}:{dt.second:02d} UTC"
+                author = f"{message.author.name}#{message.author.discriminator}"
+                content = message.content.replace("\n", " ")
+
+                f.write(f"[{timestamp}] {author}: {content}\n")
+                
+                # Store metadata for this line
+                line_count += 1
+                mf.write(dumps_json({
+                    "line": line_count,
+                    "guild_id": guild.id,
+                    "channel_id": channel.id,
+                    "message_id": message.id
+                }) + b"\n")
+
+                if message.attachments:
+                    for attachment in message.attachments:
+                        f.write(f"    [Attachment] {attachment.url}\n")
+                        line_count += 1
+
+                if message.embeds:
+                    f.write("    [Embed]\n")
+                    line_count += 1
+
+                new_last_id = message.id
+                message_count += 1
+
+        if message_count > 0 or recounted:
+            async with state_lock:
+                state[channel_key] = {
+                    "last_id": str(new_last_id) if new_last_id is not None else None,
+                    "line_count": line_count,
+                    "size": os.path.getsize(filename)
+                }
+                save_state(state)
+
+        if message_count > 0:
+            print(f"  Added {message_count} new messages to #{channel.name}")
+        else:
+            print(f"  No new messages in #{channel.name}")
+
+        await asyncio.sleep(0.5)  # polite delay
 
 
 @client.event
@@ -40,6 +194,9 @@ async def on_ready():
         os.makedirs(EXPORT_DIR)
 
     state = load_state()
+    sem = asyncio.Semaphore(CHANNEL_CONCURRENCY)
+    state_lock = asyncio.Lock()
+    file_locks = defaultdict(asyncio.Lock)
 
     for guild in client.guilds:
         print(f"\nChecking server: {guild.name}")
@@ -47,89 +204,10 @@ async def on_ready():
         guild_dir = os.path.join(EXPORT_DIR, sanitize_filename(guild.name))
         os.makedirs(guild_dir, exist_ok=True)
 
-        for channel in guild.text_channels:
-            perms = channel.permissions_for(guild.me)
-            if not perms.read_message_history:
-                print(f"Skipping {channel.name} (no permission)")
-                continue
-
-            channel_key = f"{guild.id}-{channel.id}"
-            last_id = state.get(channel_key)
-
-            filename = os.path.join(
-                guild_dir,
-                f"{sanitize_filename(channel.name)}.txt"
-            )
-            
-            metadata_filename = os.path.join(
-                guild_dir,
-                f"{sanitize_filename(channel.name)}_metadata.json"
-            )
-
-            print(f"Updating #{channel.name}")
-
-            new_last_id = last_id
-            message_count = 0
-            
-            # Load existing metadata
-            metadata_map = {}
-            if os.path.exists(metadata_filename):
-                try:
-                    with open(metadata_filename, "r", encoding="utf-8") as mf:
-                        metadata_map = json.load(mf)
-                except:
-                    metadata_map = {}
-
-            with open(filename, "a", encoding="utf-8") as f:
-
-                history_kwargs = {
-                    "limit": None,
-                    "oldest_first": True
-                }
-
-                if last_id:
-                    history_kwargs["after"] = discord.Object(id=int(last_id))
-
-                line_count = sum(1 for _ in open(filename, "rb")) if os.path.exists(filename) else 0
-
-                async for message in channel.history(**history_kwargs):
-                    timestamp = message.created_at.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
-                    author = f"{message.author.name}#{message.author.discriminator}"
-                    content = message.content.replace("\n", " ")
-
-                    f.write(f"[{timestamp}] {author}: {content}\n")
-                    
-                    # Store metadata for this line
-                    line_count += 1
-                    metadata_map[str(line_count)] = {
-                        "guild_id": guild.id,
-                        "channel_id": channel.id,
-                        "message_id": message.id
-                    }
-
-                    if message.attachments:
-                        for attachment in message.attachments:
-                            f.write(f"    [Attachment] {attachment.url}\n")
-                            line_count += 1
-
-                    if message.embeds:
-                        f.write("    [Embed]\n")
-                        line_count += 1
-
-                    new_last_id = message.id
-                    message_count += 1
-
-            if message_count > 0:
-                state[channel_key] = str(new_last_id)
-                save_state(state)
-                # Save metadata
-                with open(metadata_filename, "w", encoding="utf-8") as mf:
-                    json.dump(metadata_map, mf, indent=2)
-                print(f"  Added {message_count} new messages")
-            else:
-                print("  No new messages")
-
-            await asyncio.sleep(0.5)  # polite delay
+        await asyncio.gather(*(
+            fetch_channel(channel, state, guild_dir, sem, state_lock, file_locks)
+            for channel in guild.text_channels
+        ))
 
     print("\nIncremental update complete.")
     await client.close()
@@ -1,9 +1,14 @@
 import pickle
 import numpy as np
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
 import os
 import json
+from functools import lru_cache
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
 
 def load_vector_database(file_path='vectors.pkl'):
     """Load the vector database from pickle file."""
@@ -16,20 +21,53 @@ def load_vector_database(file_path='vectors.pkl'):
     try:
         with open(file_path, 'rb') as f:
             vector_database = pickle.load(f)
+        if 'embeddings' not in vector_database:
+            vector_database['embeddings'] = np.load(os.path.splitext(file_path)[0] + '.npy', mmap_mode='r')
+        # A float32 memory map passes through untouched; float16 files are
+        # widened once here rather than on every query
+        vector_database['embeddings'] = np.asarray(vector_database['embeddings'], dtype=np.float32)
+        # Embeddings from create_vectors are already unit length; older pickles
+        # are not, so keep their row norms to divide by at query time
+        embeddings = vector_database['embeddings']
+        if embeddings.ndim == 2:
+            row_norms = np.sqrt(np.einsum('ij,ij->i', embeddings, embeddings, dtype=np.float32))
+            vector_database['row_norms'] = None if np.allclose(row_norms, 1.0, atol=1e-3) else row_norms
+        index_path = os.path.splitext(file_path)[0] + '.faiss'
+        # An index older than the embeddings it was built from is stale, even
+        # when a rebuild happened to keep the same number of rows
+        source_path = os.path.splitext(file_path)[0] + '.npy'
+        if not os.path.exists(source_path):
+            source_path = file_path
+        if (faiss is not None and os.path.exists(index_path)
+                and os.path.getmtime(index_path) >= os.path.getmtime(source_path)):
+            index = faiss.read_index(index_path)
+            if index.ntotal == len(embeddings):
+                vector_database['faiss_index'] = index
+        if 'model' not in vector_database:
+            vector_database['model'] = SentenceTransformer(vector_database['model_name'])
         model = vector_database['model']
+        _encode.cache_clear()
         print(f"Loaded vector database with {len(vector_database['embeddings'])} embeddings")
         return True
     except Exception as e:
         print(f"Error loading vector database: {e}")
         return False
 
+@lru_cache(maxsize=1024)
+def _encode(query):
+    """Encode a query to a unit-length embedding, reusing it for repeated queries."""
+    query_embedding = model.encode([query], convert_to_numpy=True, normalize_embeddings=True)[0]
+    # The cached array is shared between calls, so guard it against writes
+    query_embedding.flags.writeable = False
+    return query_embedding
+
 def search_vectors(query, top_k=10):
     """Search for similar vectors to the query."""
     if vector_database is None:
         return []
     
-    # Create embedding for the query
-    query_embedding = model.encode([query])
+    # Create a unit-length embedding for the query
+    query_embedding = _encode(query)
     
     # Get all embeddings
     embeddings = vector_database['embeddings']
@@ -37,20 +75,30 @@ def search_vectors(query, top_k=10):
     if len(embeddings) == 0:
         return []
     
-    # Calculate cosine similarities
-    similarities = cosine_similarity(query_embedding, embeddings)[0]
-    
-    # Get top k indices
-    top_indices = np.argsort(similarities)[::-1][:top_k]
+    if 'faiss_index' in vector_database:
+        # Blocked SIMD inner products with a k-sized heap instead of a full sort
+        scores, indices = vector_database['faiss_index'].search(query_embedding[np.newaxis, :], top_k)
+        top_indices, top_scores = indices[0], scores[0]
+    else:
+        # Calculate cosine similarities with a single matrix-vector product
+        similarities = embeddings @ query_embedding
+        if vector_database['row_norms'] is not None:
+            similarities /= vector_database['row_norms'] + 1e-12
+        
+        k = min(top_k, len(similarities))
+        top_indices = np.argpartition(-similarities, k - 1)[:k] if k > 0 else np.empty(0, dtype=np.intp)
+        top_indices = top_indices[np.argsort(-similarities[top_indices])]
+        top_scores = similarities[top_indices]
     
     # Get top k results with scores
     results = []
-    for idx in top_indices:
-        if similarities[idx] > 0:  # Only include results with some similarity
+    for idx, score in zip(top_indices, top_scores):
+        if score > 0:  # Only include results with some similarity
+            metadata = vector_database['message_metadata'][idx]
             results.append({
-                'score': float(similarities[idx]),
-                'metadata': vector_database['message_metadata'][idx],
-                'content': vector_database['message_metadata'][idx]['original_message']['content']
+                'score': float(score),
+                'metadata': metadata,
+                'content': metadata['content'] if 'content' in metadata else metadata['original_message']['content']
             })
     
     return results
@@ -2,8 +2,13 @@
 import pickle
 import numpy as np
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
 import os
+from functools import lru_cache
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
 
 def load_vector_database(file_path='vectors.pkl'):
     """
@@ -22,6 +27,36 @@ def load_vector_database(file_path='vectors.pkl'):
     with open(file_path, 'rb') as f:
         vector_database = pickle.load(f)
     
+    # Embeddings moved out of the pickle are memory-mapped from the .npy file
+    if 'embeddings' not in vector_database:
+        vector_database['embeddings'] = np.load(os.path.splitext(file_path)[0] + '.npy', mmap_mode='r')
+    
+    # The model is not pickled (older pickles may still carry one), so load it by name
+    if 'model' not in vector_database:
+        vector_database['model'] = SentenceTransformer(vector_database['model_name'])
+    
+    # Keep a float32 memory map as is, but widen float16 storage up front so
+    # queries run on float32 BLAS
+    vector_database['embeddings'] = np.asarray(vector_database['embeddings'], dtype=np.float32)
+    
+    # The corpus is static, so compute its row norms once rather than per query
+    embeddings = vector_database['embeddings']
+    if embeddings.ndim == 2:
+        vector_database['row_norms'] = np.sqrt(np.einsum('ij,ij->i', embeddings, embeddings, dtype=np.float32))
+    
+    # Use the FAISS index saved by create_vectors when it covers these embeddings
+    index_path = os.path.splitext(file_path)[0] + '.faiss'
+    # An index older than the embeddings it was built from is stale, even
+    # when a rebuild happened to keep the same number of rows
+    source_path = os.path.splitext(file_path)[0] + '.npy'
+    if not os.path.exists(source_path):
+        source_path = file_path
+    if (faiss is not None and os.path.exists(index_path)
+            and os.path.getmtime(index_path) >= os.path.getmtime(source_path)):
+        index = faiss.read_index(index_path)
+        if index.ntotal == len(embeddings):
+            vector_database['faiss_index'] = index
+    
     print(f"Loaded vector database with {len(vector_database['embeddings'])} embeddings")
     return vector_database
 
@@ -41,7 +76,7 @@ def search_vectors(query, vector_database, top_k=10):
     model = vector_database['model']
     
     # Create embedding for the query
-    query_embedding = model.encode([query])
+    query_embedding = model.encode([query])[0].astype(np.float32, copy=False)
     
     # Get all embeddings
     embeddings = vector_database['embeddings']
@@ -50,20 +85,32 @@ def search_vectors(query, vector_database, top_k=10):
         print("No embeddings found in database")
         return []
     
-    # Calculate cosine similarities
-    similarities = cosine_similarity(query_embedding, embeddings)[0]
-    
-    # Get top k indices
-    top_indices = np.argsort(similarities)[::-1][:top_k]
+    if 'faiss_index' in vector_database:
+        # The indexed rows are unit length, so normalize the query to get cosine scores
+        query_embedding = query_embedding / (np.sqrt(np.vdot(query_embedding, query_embedding)) + 1e-12)
+        scores, indices = vector_database['faiss_index'].search(query_embedding[np.newaxis, :], top_k)
+        top_indices, top_scores = indices[0], scores[0]
+    else:
+        # Calculate cosine similarities from one matrix-vector product and the
+        # row norms cached at load time
+        similarities = embeddings @ query_embedding
+        similarities /= vector_database['row_norms'] * np.sqrt(np.vdot(query_embedding, query_embedding)) + 1e-12
+        
+        k = min(top_k, len(similarities))
+        top_indices = np.argpartition(-similarities, k - 1)[:k] if k > 0 else np.empty(0, dtype=np.intp)
+        top_indices = top_indices[np.argsort(-similarities[top_indices])]
+        top_scores = similarities[top_indices]
     
     # Get top k results with scores
     results = []
-    for idx in top_indices:
-        if similarities[idx] > 0:  # Only include results with some similarity
+    for idx, score in zip(top_indices, top_scores):
+        if score > 0:  # Only include results with some similarity
+            metadata = vector_database['message_metadata'][idx]
             results.append({
-                'score': similarities[idx],
-                'metadata': vector_database['message_metadata'][idx],
-                'content': vector_database['message_metadata'][idx]['original_message']['content']
+                'score': score,
+                'metadata': metadata,
+                # Older pickles keep the content inside a copy of the whole message
+                'content': metadata['content'] if 'content' in metadata else metadata['original_message']['content']
             })
     
     return results
@@ -91,6 +138,34 @@ def display_results(results):
         print(f"   Line Number: {result['metadata']['line_number']}")
     
 
+@lru_cache(maxsize=256)
+def load_line_offsets(source_file, mtime):
+    """
+    Index the byte offset at which every line of a source file starts.
+    
+    Args:
+        source_file (str): Path to the source file
+        mtime (float): Modification time of the file, so edits invalidate the cache
+    
+    Returns:
+        np.ndarray: Start offset of each line, followed by the file size
+    """
+    size = os.path.getsize(source_file)
+    if size == 0:
+        return np.zeros(1, dtype=np.int64)
+    
+    data = np.memmap(source_file, dtype=np.uint8, mode='r')
+    # Match the universal newlines chunk.py numbered lines with: a line ends
+    # at '\n', '\r\n', or a lone '\r'
+    line_ends = data == ord('\n')
+    lone_cr = data == ord('\r')
+    lone_cr[:-1] &= data[1:] != ord('\n')
+    offsets = np.flatnonzero(line_ends | lone_cr) + 1
+    # A final line without a trailing newline still ends at the end of the file
+    if len(offsets) == 0 or offsets[-1] != size:
+        offsets = np.append(offsets, size)
+    return np.concatenate(([0], offsets)).astype(np.int64)
+
 def get_surrounding_messages(result, context_lines=5):
     """
     Display surrounding lines from the source file.
@@ -107,12 +182,20 @@ def get_surrounding_messages(result, context_lines=5):
         return
     
     try:
-        with open(source_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
+        offsets = load_line_offsets(source_file, os.path.getmtime(source_file))
         
         # Calculate start and end line numbers
         start_line = max(0, line_number - context_lines - 1)
-        end_line = min(len(lines), line_number + context_lines)
+        end_line = min(len(offsets) - 1, line_number + context_lines)
+        
+        # Read only the bytes spanning the requested lines
+        lines = []
+        if end_line > start_line:
+            with open(source_file, 'rb') as f:
+                f.seek(int(offsets[start_line]))
+                data = f.read(int(offsets[end_line] - offsets[start_line]))
+            bounds = (offsets[start_line:end_line + 1] - offsets[start_line]).tolist()
+            lines = [data[begin:end].decode('utf-8') for begin, end in zip(bounds, bounds[1:])]
         
         print(f"\nSurrounding context for line {line_number} in {source_file}:")
         print("-" * 80)
@@ -121,7 +204,7 @@ def get_surrounding_messages(result, context_lines=5):
         for i in range(start_line, end_line):
             line_num = i + 1
             marker = ">>> " if line_num == line_number else "    "
-            print(f"{line_num:4d}: {marker}{lines[i].rstrip()}")
+            print(f"{line_num:4d}: {marker}{lines[i - start_line].rstrip()}")
             
     except Exception as e:
         print(f"Error reading file: {e}")
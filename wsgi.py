@@ -0,0 +1,18 @@
+# wsgi.py
+# Production entry point for the search app:
+#
+#   gunicorn -w 4 --threads 8 --preload -b 0.0.0.0:5000 wsgi:app
+#
+# --preload imports app once in the master process, so the vector database
+# and the sentence transformer are loaded before forking and the workers
+# share those pages copy-on-write instead of each loading their own copy.
+# --threads serves several requests per worker at once, which is what lets
+# the query batcher coalesce concurrent searches into one model call.
+import gc
+
+from app import app
+
+# Move everything loaded so far into the permanent generation, so garbage
+# collections in the workers never write to (and so privately copy) the
+# pages holding the model and the metadata
+gc.freeze()